@@ -0,0 +1,58 @@
+from typing import Any, Callable, Hashable, Optional
+from collections import OrderedDict
+import functools
+import threading
+import time
+
+_MISSING = object()
+
+class SmartRAGCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+def smart_cache(ttl: float = 300.0, maxsize: int = 512, key: Optional[Callable[..., Hashable]] = None):
+    def decorator(func):
+        cache = SmartRAGCache(maxsize=maxsize, ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            cache_key = key(*args) if key else args
+            value = cache.get(cache_key, _MISSING)
+            if value is _MISSING:
+                value = func(*args)
+                cache.set(cache_key, value)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
\ No newline at end of file
@@ -1,8 +1,52 @@
-import json
+import hashlib
+import logging
+import os
+import pickle
+import orjson
 from typing import List
 from models import Restaurant
+import dsa
+import models
+
+logger = logging.getLogger(__name__)
 
 def load_data(filepath: str) -> List[Restaurant]:
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-    return [Restaurant(**item) for item in data]
+    with open(filepath, 'rb') as f:
+        data = orjson.loads(f.read())
+    return [Restaurant.model_validate(item) for item in data]
+
+def _index_digest(raw: bytes) -> str:
+    # The pickled indices depend on the dataset and on the classes that built
+    # them, so editing either module invalidates the cache as well.
+    digest = hashlib.sha256(raw)
+    for module in (dsa, models):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def load_manager(filepath: str, cache_path: str) -> dsa.RestaurantManager:
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    digest = _index_digest(raw)
+
+    # The pickle is only a cache: anything wrong with it (missing, truncated,
+    # built by other code, wrong shape) means rebuilding from the JSON.
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_digest, manager = pickle.load(f)
+        if cached_digest == digest and isinstance(manager, dsa.RestaurantManager):
+            return manager
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unusable index cache {cache_path}: {e}")
+
+    manager = dsa.RestaurantManager([Restaurant.model_validate(item) for item in orjson.loads(raw)])
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((digest, manager), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return manager
\ No newline at end of file
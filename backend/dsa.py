@@ -1,109 +1,229 @@
-from typing import List, Dict, Set
+from typing import List, Dict, Iterator, Tuple, Optional
+from array import array
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+import re
 from models import Restaurant
 
+_LOC_SPLIT = re.compile(r'[,\s]+')
+
+@lru_cache(maxsize=1024)
+def tokenize(query: str) -> Tuple[str, ...]:
+    return tuple(query.lower().split())
+
+def iter_bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+_WIDE_FANOUT = 4
+
+def _common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
 class TrieNode:
-    def __init__(self):
-        self.children = {}
+    __slots__ = ('label', 'children', 'is_end_of_word', 'restaurant_ids', 'subtree_ids')
+
+    def __init__(self, label: str = ""):
+        # label is the edge fragment leading into this node; children are keyed
+        # by the first character of their label. None for leaves, a dict for
+        # narrow nodes, and a 128-slot list indexed by ASCII code once a node
+        # fans out past _WIDE_FANOUT.
+        self.label = label
+        self.children = None
         self.is_end_of_word = False
-        self.restaurant_ids = set()
+        self.restaurant_ids = 0
+        self.subtree_ids = 0
+
+    def get_child(self, char: str) -> Optional['TrieNode']:
+        children = self.children
+        if children is None:
+            return None
+        if type(children) is list:
+            code = ord(char)
+            return children[code] if code < 128 else None
+        return children.get(char)
+
+    def put_child(self, child: 'TrieNode'):
+        char = child.label[0]
+        children = self.children
+        if children is None:
+            self.children = {char: child}
+        elif type(children) is list:
+            if ord(char) < 128:
+                children[ord(char)] = child
+            else:
+                self.children = {chr(code): node for code, node in enumerate(children) if node is not None}
+                self.children[char] = child
+        else:
+            children[char] = child
+            if len(children) > _WIDE_FANOUT and all(ord(c) < 128 for c in children):
+                wide = [None] * 128
+                for c, node in children.items():
+                    wide[ord(c)] = node
+                self.children = wide
+
+    def iter_children(self) -> Iterator['TrieNode']:
+        children = self.children
+        if children is None:
+            return iter(())
+        if type(children) is list:
+            return (node for node in children if node is not None)
+        return iter(children.values())
 
 class Trie:
     def __init__(self):
         self.root = TrieNode()
+        self._dirty = False
 
-    def insert(self, word: str, restaurant_id: str):
+    def insert(self, word: str, restaurant_idx: int):
         node = self.root
-        for char in word.lower():
-            if char not in node.children:
-                node.children[char] = TrieNode()
-            node = node.children[char]
+        rest = word.lower()
+        while rest:
+            child = node.get_child(rest[0])
+            if child is None:
+                child = TrieNode(rest)
+                node.put_child(child)
+                node = child
+                break
+
+            common = _common_prefix_len(child.label, rest)
+            if common < len(child.label):
+                # Split the edge where the new word diverges from it.
+                mid = TrieNode(child.label[:common])
+                child.label = child.label[common:]
+                mid.put_child(child)
+                node.put_child(mid)
+                child = mid
+            node = child
+            rest = rest[common:]
+
         node.is_end_of_word = True
-        node.restaurant_ids.add(restaurant_id)
+        node.restaurant_ids |= 1 << restaurant_idx
+        self._dirty = True
+
+    def build_subtree_ids(self):
+        # Post-order walk with an explicit stack: every node caches the ids of
+        # all words below it, so a prefix lookup never has to visit descendants.
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                ids = node.restaurant_ids
+                for child in node.iter_children():
+                    ids |= child.subtree_ids
+                node.subtree_ids = ids
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.iter_children())
+        self._dirty = False
+
+    def search_prefix(self, prefix: str) -> int:
+        # Expects a lowercase prefix, like the names it was built from.
+        if self._dirty:
+            self.build_subtree_ids()
 
-    def search_prefix(self, prefix: str) -> Set[str]:
         node = self.root
-        for char in prefix.lower():
-            if char not in node.children:
-                return set()
-            node = node.children[char]
-        
-        return self._collect_ids(node)
+        rest = prefix
+        while rest:
+            child = node.get_child(rest[0])
+            if child is None:
+                return 0
+            label = child.label
+            if rest.startswith(label):
+                rest = rest[len(label):]
+                node = child
+            elif label.startswith(rest):
+                return child.subtree_ids
+            else:
+                return 0
 
-    def _collect_ids(self, node: TrieNode) -> Set[str]:
-        ids = set()
-        if node.is_end_of_word:
-            ids.update(node.restaurant_ids)
-        
-        for child in node.children.values():
-            ids.update(self._collect_ids(child))
-        return ids
+        return node.subtree_ids
+
+def intersect_postings(postings: List[int]) -> int:
+    if not postings:
+        return 0
+    if len(postings) == 1:
+        return postings[0]
+    # Sparsest bitmap first so a rare term empties the result before the
+    # dense ones are touched.
+    postings = sorted(postings, key=int.bit_count)
+    result_ids = postings[0]
+    for ids in postings[1:]:
+        result_ids &= ids
+        if not result_ids:
+            break
+    return result_ids
+
+def union_postings(postings: List[int]) -> int:
+    if len(postings) == 1:
+        return postings[0]
+    result_ids = 0
+    for ids in postings:
+        result_ids |= ids
+    return result_ids
 
 class InvertedIndex:
     def __init__(self):
-        self.index: Dict[str, Set[str]] = {}
-
-    def add_restaurant(self, restaurant: Restaurant):
-        for menu_item in restaurant.menu:
-            words = menu_item.item.lower().split()
-            for word in words:
-                if word not in self.index:
-                    self.index[word] = set()
-                self.index[word].add(restaurant.id)
-
-    def search(self, query: str) -> Set[str]:
-        words = query.lower().split()
-        if not words:
-            return set()
-        
-        result_ids = set()
+        self.index: Dict[str, int] = {}
+
+    def add_restaurant(self, restaurant: Restaurant, restaurant_idx: int):
+        bit = 1 << restaurant_idx
+        words = {word for item in restaurant._menu_items_lc for word in item.split()}
         for word in words:
-            if word in self.index:
-                result_ids.update(self.index[word])
-        return result_ids
+            self.index[word] = self.index.get(word, 0) | bit
+
+    def lookup(self, tokens: Tuple[str, ...], match_all: bool = False) -> int:
+        postings = [self.index[w] for w in tokens if w in self.index]
+        if match_all:
+            return intersect_postings(postings)
+        return union_postings(postings)
+
+    def search(self, query: str, match_all: bool = False) -> int:
+        return self.lookup(tokenize(query), match_all)
 
 class LocationIndex:
     def __init__(self):
-        self.index: Dict[str, Set[str]] = {}
+        self.index: Dict[str, int] = {}
 
-    def add_restaurant(self, restaurant: Restaurant):
+    def add_restaurant(self, restaurant: Restaurant, restaurant_idx: int):
         if not restaurant.location:
             return
-            
-        import re
-        words = re.split(r'[,\s]+', restaurant.location.lower())
-        for word in words:
+
+        bit = 1 << restaurant_idx
+        for word in _LOC_SPLIT.split(restaurant._location_lc):
             if not word: continue
-            if word not in self.index:
-                self.index[word] = set()
-            self.index[word].add(restaurant.id)
-
-    def search(self, query: str) -> Set[str]:
-        words = query.lower().split()
-        if not words:
-            return set()
-        
-        valid_words = [w for w in words if w in self.index]
-        
-        if not valid_words:
-            return set()
-            
-        result_ids = self.index[valid_words[0]].copy()
-        
-        for word in valid_words[1:]:
-            result_ids.intersection_update(self.index[word])
-            
-        return result_ids
+            self.index[word] = self.index.get(word, 0) | bit
+
+    def lookup(self, tokens: Tuple[str, ...]) -> int:
+        postings = [self.index[w] for w in tokens if w in self.index]
+        return intersect_postings(postings)
+
+    def search(self, query: str) -> int:
+        return self.lookup(tokenize(query))
 
 class RestaurantManager:
     def __init__(self, restaurants: List[Restaurant]):
         self.restaurants = {r.id: r for r in restaurants}
+        self.idx_to_restaurant: List[Restaurant] = list(self.restaurants.values())
+        self.id_to_idx: Dict[str, int] = {r.id: i for i, r in enumerate(self.idx_to_restaurant)}
         self.trie = Trie()
         self.menu_index = InvertedIndex()
         self.location_index = LocationIndex()
+        self.item_prices = array('i')
+        self.item_owner = array('I')
+        self.item_pos = array('I')
+        self.name_terms: Dict[str, int] = {}
+        self.cuisine_terms: Dict[str, int] = {}
         self._build_indices()
 
     def _build_indices(self):
-        for r in self.restaurants.values():
+        for idx, r in enumerate(self.idx_to_restaurant):
             if not r.cuisine and r.category:
                 r.cuisine = [c.strip() for c in r.category.split('/')]
             
@@ -119,35 +239,139 @@ class RestaurantManager:
             if not r.location:
                 r.location = "Peshawar"
 
-            self.trie.insert(r.name, r.id)
-            self.menu_index.add_restaurant(r)
-            self.location_index.add_restaurant(r)
+            r._name_lc = r.name.lower()
+            r._budget_lc = (r.budget or "").lower()
+            r._location_lc = r.location.lower()
+            r._menu_items_lc = tuple(m.item.lower() for m in r.menu)
+            r._menu_sample = ", ".join(f"{m.item} ({m.price})" for m in r.menu[:5])
+            r._cuisine_joined = ", ".join(r.cuisine)
+            r._snippet = (
+                f"- Name: {r.name}\n  Location: {r.location}\n  Budget: {r.budget}\n"
+                f"  Cuisine: {r._cuisine_joined}\n  Deals: {r.deals}\n"
+            )
+            r._snippet_with_menu = f"{r._snippet}  Menu Sample: {r._menu_sample}\n"
+
+            self.trie.insert(r._name_lc, idx)
+            self.menu_index.add_restaurant(r, idx)
+            self.location_index.add_restaurant(r, idx)
+            bit = 1 << idx
+            for word in r._name_lc.split():
+                self.name_terms[word] = self.name_terms.get(word, 0) | bit
+            for word in {w for c in r.cuisine for w in _LOC_SPLIT.split(c.lower()) if w}:
+                self.cuisine_terms[word] = self.cuisine_terms.get(word, 0) | bit
+
+            for pos, item in enumerate(r.menu):
+                self.item_prices.append(item.price)
+                self.item_owner.append(idx)
+                self.item_pos.append(pos)
+
+        self.trie.build_subtree_ids()
+        self._sort_items_by_price()
+        self._name_vocab = frozenset(self.name_terms)
+        self._name_words = sorted(self._name_vocab)
+
+    def _sort_items_by_price(self):
+        # Ascending by price, ties in menu order once reversed, so a budget
+        # lookup is a bisect plus a backwards slice.
+        prices = self.item_prices
+        order = sorted(range(len(prices)), key=lambda i: (prices[i], -i))
+        self.item_prices = array('i', (prices[i] for i in order))
+        self.item_owner = array('I', (self.item_owner[i] for i in order))
+        self.item_pos = array('I', (self.item_pos[i] for i in order))
+
+    def _may_match_name(self, tokens: Tuple[str, ...]) -> bool:
+        # A message can only be a name prefix if every token but the last is a
+        # whole name word and the last starts one, so small talk like
+        # "kya scene hai" skips the trie entirely.
+        if not tokens:
+            return True
+        *head, last = tokens
+        if any(t not in self._name_vocab for t in head):
+            return False
+        i = bisect_left(self._name_words, last)
+        return i < len(self._name_words) and self._name_words[i].startswith(last)
 
     def search_by_name(self, prefix: str) -> List[Restaurant]:
-        ids = self.trie.search_prefix(prefix)
-        return [self.restaurants[id] for id in ids]
+        ids = self.trie.search_prefix(prefix.lower())
+        return [self.idx_to_restaurant[i] for i in iter_bits(ids)]
 
-    def search_by_menu(self, query: str) -> List[Restaurant]:
-        ids = self.menu_index.search(query)
-        return [self.restaurants[id] for id in ids]
+    def search_by_menu(self, query: str, match_all: bool = False) -> List[Restaurant]:
+        ids = self.menu_index.search(query, match_all)
+        return [self.idx_to_restaurant[i] for i in iter_bits(ids)]
         
     def search_by_location(self, query: str) -> List[Restaurant]:
         ids = self.location_index.search(query)
-        return [self.restaurants[id] for id in ids]
+        return [self.idx_to_restaurant[i] for i in iter_bits(ids)]
+
+    def _candidate_stages(self, tokens: Tuple[str, ...], max_price: Optional[int]) -> Iterator[int]:
+        # Lazily yields one bitmap per search, in priority order, so the caller
+        # can stop before running searches whose hits would be cut anyway.
+        if max_price is not None:
+            ids = 0
+            for row in self._budget_rows(max_price, limit=10):
+                ids |= 1 << self.item_owner[row]
+            yield ids
+        yield self.location_index.lookup(tokens)
+        yield self.menu_index.lookup(tokens)
+        if len(tokens) < 5 and self._may_match_name(tokens):
+            yield self.trie.search_prefix(" ".join(tokens))
+
+    def search_candidate_ids(self, message: str, max_price: Optional[int] = None, limit: int = 15) -> List[int]:
+        # One tokenization and one seen-bitmap across every index, so a
+        # restaurant hit by several searches is only collected once.
+        tokens = tokenize(message)
+        results = []
+        seen = 0
+        for stage_ids in self._candidate_stages(tokens, max_price):
+            new_ids = stage_ids & ~seen
+            seen |= new_ids
+            for i in iter_bits(new_ids):
+                results.append(i)
+                if len(results) == limit:
+                    return results
+        return results
+
+    def rerank_candidate_ids(self, message: str, ids: List[int], k: int, max_price: Optional[int] = None) -> List[int]:
+        # Recall above is ordered by which search found a restaurant first;
+        # this orders the pool by weighted query-term hits across name,
+        # cuisine, menu and location (plus having items within budget).
+        # Ties keep the recall order.
+        tokens = dict.fromkeys(tokenize(message))
+        hits = [
+            (index[t], weight)
+            for index, weight in ((self.name_terms, 3), (self.cuisine_terms, 2), (self.menu_index.index, 2), (self.location_index.index, 1))
+            for t in tokens if t in index
+        ]
+        if max_price is not None:
+            affordable = 0
+            for owner in self.item_owner[:bisect_right(self.item_prices, max_price)]:
+                affordable |= 1 << owner
+            hits.append((affordable, 2))
+        if not hits:
+            return ids[:k]
+        scores = {i: sum(weight for posting, weight in hits if posting >> i & 1) for i in ids}
+        return sorted(ids, key=scores.__getitem__, reverse=True)[:k]
+
+    def search_candidates(self, message: str, max_price: Optional[int] = None, limit: int = 15) -> List[Restaurant]:
+        return [self.idx_to_restaurant[i] for i in self.search_candidate_ids(message, max_price, limit)]
 
     def filter_by_budget(self, budget: str) -> List[Restaurant]:
-        return [r for r in self.restaurants.values() if r.budget.lower() == budget.lower()]
+        budget_lc = budget.lower()
+        return [r for r in self.idx_to_restaurant if r._budget_lc == budget_lc]
+
+    def _budget_rows(self, max_price: int, limit: Optional[int] = None) -> List[int]:
+        cut = bisect_right(self.item_prices, max_price)
+        stop = 0 if limit is None else max(cut - limit, 0)
+        return list(range(cut - 1, stop - 1, -1))
 
-    def search_items_by_budget(self, max_price: int) -> List[dict]:
+    def search_items_by_budget(self, max_price: int, limit: Optional[int] = None) -> List[dict]:
         results = []
-        for r in self.restaurants.values():
-            for item in r.menu:
-                if item.price <= max_price:
-                    results.append({
-                        "restaurant": r,
-                        "item": item
-                    })
-        results.sort(key=lambda x: x['item'].price, reverse=True)
+        for i in self._budget_rows(max_price, limit):
+            r = self.idx_to_restaurant[self.item_owner[i]]
+            results.append({
+                "restaurant": r,
+                "item": r.menu[self.item_pos[i]]
+            })
         return results
 
     def get_restaurant(self, id: str) -> Restaurant:
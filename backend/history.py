@@ -1,19 +1,28 @@
-from typing import List, Dict, Tuple, Optional
-from models import Restaurant
+from typing import List, Dict, Tuple, Optional, Set
 import os
-import json
+import logging
+import atexit
+import sqlite3
+import orjson
 import uuid
 from datetime import datetime, timedelta
 import threading
 
+logger = logging.getLogger(__name__)
+
 
 class SessionStore:
-    def __init__(self, storage_dir: str, session_expiry_hours: int = 24, history_limit: int = 10):
+    def __init__(self, storage_dir: str, session_expiry_hours: int = 24, history_limit: int = 10,
+                 flush_interval: float = 2.0):
         self.storage_dir = storage_dir
         self.session_expiry_hours = session_expiry_hours
         self.history_limit = history_limit
+        self.flush_interval = flush_interval
         self.sessions: Dict[str, dict] = {}
         self.lock = threading.Lock()
+        self._dirty: Set[str] = set()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
         
         try:
             os.makedirs(storage_dir, exist_ok=True)
@@ -24,58 +33,101 @@ class SessionStore:
             os.makedirs(self.storage_dir, exist_ok=True)
         except Exception:
             pass
-        self._load_sessions()
+        self.db_path = os.path.join(self.storage_dir, "sessions.db")
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(id TEXT PRIMARY KEY, data BLOB, last_active INTEGER)"
+        )
+        self.db.commit()
+        self._import_legacy_files()
         self._cleanup_expired()
-    
-    def _load_sessions(self):
+        self._load_sessions()
+
+        # Messages only mark their session dirty; this thread writes dirty
+        # sessions out in batches so /chat never waits on disk.
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _expiry_cutoff(self) -> int:
+        return int((datetime.now() - timedelta(hours=self.session_expiry_hours)).timestamp())
+
+    @staticmethod
+    def _last_active_ts(session_data: dict) -> int:
+        last_active = session_data.get('last_active')
+        try:
+            return int(datetime.fromisoformat(last_active).timestamp())
+        except (TypeError, ValueError):
+            return int(datetime.now().timestamp())
+
+    def _import_legacy_files(self):
+        # Sessions used to live in one JSON file each; fold any that are still
+        # around into the database once and drop the files.
+        rows = []
+        legacy = []
         for filename in os.listdir(self.storage_dir):
             if filename.endswith('.json'):
                 filepath = os.path.join(self.storage_dir, filename)
                 try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        session_data = json.load(f)
-                        session_id = session_data.get('session_id')
-                        if session_id:
-                            self.sessions[session_id] = session_data
+                    with open(filepath, 'rb') as f:
+                        session_data = orjson.loads(f.read())
+                    session_id = session_data.get('session_id')
+                    if session_id:
+                        rows.append((session_id, orjson.dumps(session_data), self._last_active_ts(session_data)))
+                    legacy.append(filepath)
                 except Exception:
                     pass
-    
-    def _save_session(self, session_id: str):
-        if session_id not in self.sessions:
+        if not rows:
             return
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.sessions[session_id], f, indent=2, default=str)
-        except Exception:
-            pass
-    
-    def _cleanup_expired(self):
-        now = datetime.now()
-        expired = []
-        for session_id, data in self.sessions.items():
-            last_active = data.get('last_active')
-            if isinstance(last_active, str):
-                try:
-                    last_active = datetime.fromisoformat(last_active)
-                except:
-                    continue
-            if last_active and (now - last_active) > timedelta(hours=self.session_expiry_hours):
-                expired.append(session_id)
-        
-        for session_id in expired:
-            self._delete_session(session_id)
-    
-    def _delete_session(self, session_id: str):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-        filepath = os.path.join(self.storage_dir, f"{session_id}.json")
-        if os.path.exists(filepath):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO sessions (id, data, last_active) VALUES (?, ?, ?)", rows)
+        for filepath in legacy:
             try:
                 os.remove(filepath)
-            except:
+            except OSError:
                 pass
-    
+
+    def _load_sessions(self):
+        cursor = self.db.execute("SELECT id, data FROM sessions WHERE last_active > ?", (self._expiry_cutoff(),))
+        for session_id, data in cursor:
+            try:
+                self.sessions[session_id] = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+
+    def _save_session(self, session_id: str):
+        self._dirty.add(session_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self.lock:
+                dirty, self._dirty = self._dirty, set()
+                rows = [
+                    (sid, orjson.dumps(self.sessions[sid]), self._last_active_ts(self.sessions[sid]))
+                    for sid in dirty if sid in self.sessions
+                ]
+            if not rows:
+                return
+            try:
+                with self.db:
+                    self.db.executemany("INSERT OR REPLACE INTO sessions (id, data, last_active) VALUES (?, ?, ?)", rows)
+            except sqlite3.Error:
+                pass
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def _cleanup_expired(self):
+        with self._flush_lock, self.db:
+            self.db.execute("DELETE FROM sessions WHERE last_active <= ?", (self._expiry_cutoff(),))
+
     def create_session(self) -> str:
         session_id = str(uuid.uuid4())[:8]
         now = datetime.now()
@@ -100,10 +152,26 @@ class SessionStore:
                 session_id = self.create_session()
             
             session = self.sessions[session_id]
-            session['history'].append({'role': role, 'message': message})
-            
-            if len(session['history']) > self.history_limit * 2:
-                session['history'] = session['history'][-self.history_limit * 2:]
+            history = session['history']
+            history.append({'role': role, 'message': message})
+
+            # Once the window overflows, evict the oldest history_limit
+            # messages in one go and park them for summarization, so the
+            # caller can fold them into the session summary. The parking
+            # buffer is bounded: if summaries keep failing, the oldest
+            # unsummarized turns are dropped (and logged) rather than letting
+            # the prompt grow without limit.
+            overflow = len(history) - self.history_limit * 2
+            if overflow > 0:
+                evict = max(overflow, self.history_limit)
+                pending = session.setdefault('pending_summary', [])
+                pending.extend(history[:evict])
+                del history[:evict]
+                dropped = len(pending) - self.history_limit * 2
+                if dropped > 0:
+                    del pending[:dropped]
+                    session['pending_dropped'] = session.get('pending_dropped', 0) + dropped
+                    logger.warning(f"Session {session_id}: dropped {dropped} unsummarized turns; summaries are falling behind.")
             
             session['last_active'] = datetime.now().isoformat()
             self._save_session(session_id)
@@ -118,5 +186,45 @@ class SessionStore:
         history = self.get_history(session_id)
         return [(h.get('role', ''), h.get('message', '')) for h in history]
     
+    def get_pending_tuples(self, session_id: str) -> List[Tuple[str, str]]:
+        pending = self.sessions.get(session_id, {}).get('pending_summary', [])
+        return [(h.get('role', ''), h.get('message', '')) for h in pending]
+
+    def get_summary(self, session_id: str) -> str:
+        if session_id in self.sessions:
+            return self.sessions[session_id].get('summary', '')
+        return ''
+
+    def has_pending_summary(self, session_id: str) -> bool:
+        return bool(self.sessions.get(session_id, {}).get('pending_summary'))
+
+    def take_pending_summary(self, session_id: str) -> Tuple[str, List[Dict[str, str]]]:
+        # Evicted turns stay in pending_summary (and in the prompt) until
+        # set_summary has folded them in, so a slow or failed summary doesn't
+        # drop them; only the bounded buffer in add_message can, with a
+        # warning.
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return '', []
+            session['pending_mark'] = session.get('pending_dropped', 0)
+            return session.get('summary', ''), list(session.get('pending_summary', []))
+
+    def set_summary(self, session_id: str, summary: str, covered: int = 0):
+        # covered is how many turns from the front of the batch returned by
+        # take_pending_summary the summary includes; any of those the buffer
+        # cap dropped in the meantime are already gone.
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return
+            session['summary'] = summary
+            dropped_since = session.get('pending_dropped', 0) - session.pop('pending_mark', session.get('pending_dropped', 0))
+            pending = session.get('pending_summary', [])
+            del pending[:max(covered - dropped_since, 0)]
+            if not pending:
+                session.pop('pending_summary', None)
+            self._save_session(session_id)
+
     def session_exists(self, session_id: str) -> bool:
         return session_id in self.sessions
@@ -1,18 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, AsyncIterator, Final
 import os
 import logging
 import re
 import datetime
+import asyncio
+import hashlib
+import secrets
+import functools
+import time
+import orjson
 from dotenv import load_dotenv
 
 from models import Restaurant
 from dsa import RestaurantManager
-from data_loader import load_data
+from data_loader import load_manager
 from history import SessionStore
+from cache import SmartRAGCache, smart_cache
 
 import google.generativeai as genai
 
@@ -21,6 +28,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# No default_response_class: routes with a response_model are serialized
+# straight to JSON bytes by pydantic-core, and a custom class such as
+# ORJSONResponse would switch them back to jsonable_encoder.
 app = FastAPI(title="Peshawar Restaurant Chatbot API")
 
 static_dir = os.path.join(os.path.dirname(__file__), "static")
@@ -28,18 +38,22 @@ assets_dir = os.path.join(static_dir, "assets")
 sessions_dir = os.path.join(os.path.dirname(__file__), "data", "sessions")
 os.makedirs(assets_dir, exist_ok=True)
 
+# The built frontend is served from this app, so only a separately hosted
+# frontend (the Vite dev server by default) needs a cross-origin grant.
+FRONTEND_ORIGINS = [o.strip() for o in os.getenv("FRONTEND_ORIGIN", "http://localhost:5173").split(",") if o.strip()]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=FRONTEND_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["X-Session-Id"],
 )
 
 manager: Optional[RestaurantManager] = None
 session_store: Optional[SessionStore] = None
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 
 @app.exception_handler(Exception)
@@ -60,87 +74,220 @@ async def validation_exception_handler(request, exc):
 
 model = None
 valid_models = []
+dataset_version = ""
+
+PREFERRED_MODELS = ["models/gemini-2.5-flash", "models/gemini-2.0-flash", "models/gemini-1.5-flash"]
+AVAILABLE_MODELS: List[str] = PREFERRED_MODELS[:]
+CHAT_MODELS: List[str] = PREFERRED_MODELS[:]
+MODELS_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "foodai", "models.json")
+MODELS_CACHE_TTL_SECONDS = 24 * 60 * 60
+_background_tasks = set()
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_model_cache: Dict[str, genai.GenerativeModel] = {}
+
+_model_pool: Dict[str, genai.GenerativeModel] = {}
+
+def get_model(name: str) -> genai.GenerativeModel:
+    if name not in _model_cache:
+        _model_cache[name] = genai.GenerativeModel(name)
+    return _model_cache[name]
+
+def build_model_pool(names: List[str]):
+    # Persona models carry the system prompt as system_instruction, built
+    # once per model name instead of on the request path.
+    for name in names:
+        if name not in _model_pool:
+            _model_pool[name] = genai.GenerativeModel(name, system_instruction=SYSTEM_PROMPT)
+
+CONTEXT_CACHE_TTL_SECONDS = 60 * 60
+CONTEXT_CACHE_REFRESH_SECONDS = CONTEXT_CACHE_TTL_SECONDS - 5 * 60
+_context_cache: Dict[str, object] = {"model_name": None, "model": None, "content": None}
+
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_FAILURE_WINDOW_SECONDS = 60
+BREAKER_OPEN_SECONDS = 30
+
+class ModelCircuitBreaker:
+    # Each request makes a single Gemini attempt. Models that keep failing
+    # are skipped for BREAKER_OPEN_SECONDS so later requests go straight to
+    # a healthy fallback instead of timing out on the broken one first.
+    def __init__(self):
+        self.state: Dict[str, dict] = {}
+        self.last_good: Optional[str] = None
+
+    def is_open(self, name: str, now: float) -> bool:
+        st = self.state.get(name)
+        return bool(st) and st['fail_count'] >= BREAKER_FAILURE_THRESHOLD and now - st['opened_at'] <= BREAKER_OPEN_SECONDS
+
+    def pick(self, names: List[str]) -> str:
+        now = time.time()
+        ordered = [self.last_good] + names if self.last_good in names else names
+        for name in ordered:
+            if not self.is_open(name, now):
+                return name
+        return names[0]
+
+    def record_success(self, name: str):
+        self.state.pop(name, None)
+        self.last_good = name
+
+    def record_failure(self, name: str):
+        now = time.time()
+        st = self.state.setdefault(name, {'fail_count': 0, 'first_failed_at': now, 'opened_at': 0.0})
+        if now - st['first_failed_at'] > BREAKER_FAILURE_WINDOW_SECONDS:
+            st['fail_count'] = 0
+            st['first_failed_at'] = now
+        st['fail_count'] += 1
+        if st['fail_count'] >= BREAKER_FAILURE_THRESHOLD:
+            st['opened_at'] = now
+            logger.warning(f"Circuit open for {name} after {st['fail_count']} failures.")
+        if self.last_good == name:
+            self.last_good = None
+
+model_breaker = ModelCircuitBreaker()
+
+MAX_CONTEXT_CANDIDATES = 8
+MAX_SUGGESTIONS = 15
+RERANK_POOL_SIZE = 30
+
+_BUDGET_RE = re.compile(
+    r'(?<![a-z])(?:budget|under|below|within|upto|max|rs\.?|pkr|tak)\W{0,3}(\d{2,6})(?!\d)'
+    r'|(?<!\d)(\d{2,6})\s*(?:rs|pkr|rupees?|tak)(?![a-z])'
+)
+_AMOUNT_RE = re.compile(r'(?<!\d)(\d{2,6})(?!\d)')
+_BUDGET_HINT_RE = re.compile(r'(?<![a-z])(?:budget|under|below|within|upto|max|pkr|rs|rupees?|tak)(?![a-z])')
+
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+
+@functools.cache
+def load_prompt(name: str) -> str:
+    with open(os.path.join(PROMPTS_DIR, f"{name}.txt"), 'r', encoding='utf-8') as f:
+        return f.read()
+
+PERSONA = os.getenv("PERSONA", "inzaghi")
+SYSTEM_PROMPT: Final[str] = load_prompt(PERSONA)
 
-INZAGHI_SYSTEM_PROMPT = """
-You are Inzaghi, a friendly, local "Peshawari" food enthusiast and AI guide.
-Your goal is to help users find the best restaurants in Peshawar based on their cravings, budget, and location.
-
-=== PERSONALITY & STYLE ===
-- Desi Gen-Z vibe: Use terms like "bro", "scene", "full vibe", "real one", "lowkey", "no cap"
-- Roman Urdu allowed and encouraged (e.g., "Yaara", "Kha", "Zabardast", "Maaf ka", "Sahi hai")
-- Confident, street-smart, foodie energy
-- No forced memes, no cringe slang
-- Humor must add personality, not distract from info
-
-=== ROASTING PHILOSOPHY ===
-You may occasionally roast the user personally, but ONLY when:
-• The user contradicts themselves (diet vs order)
-• The user is indecisive or unrealistic
-• The user asks for "best + cheap + luxury + large portion" together
-Roasting must feel EARNED, not random.
-
-=== ROASTING LIMITS (STRICT) ===
-• Max 1 personal roast line, and only in SOME responses
-• NEVER roast on: Intelligence, class, money status, family, looks, culture
-• Roast BEHAVIOR, not identity
-• Tone: Confident, dry, slightly savage — but friendly
-• "Calling you out" energy, NOT bullying
-• If there's doubt → soften or skip
-
-=== EXAMPLES OF ACCEPTABLE ROASTING ===
-• "Aap 'simple khana' bol ke phir sab se heavy cheez shortlist kar rahe ho — consistency thori weak hai."
-• "Budget tight hai, lekin expectations bilkul CEO level hain — respect."
-• "Decision itna slow hai ke lagta hai menu nahi, life choose ho rahi hai."
-• "Diet ka intention strong hai, lekin follow-through… questionable."
-• "Bro keto pe ho lekin biryani bhi chahiye — yeh kaunsi timeline hai?"
-
-=== EXAMPLES OF TOO FAR (NEVER DO THIS) ===
-• Direct insults
-• Repeated jokes about the same habit
-• Anything that feels judgmental instead of playful
-• Mocking accent, background, or financial status
-
-=== DESI GEN-Z HUMOR EXAMPLES ===
-• "Yaar itna options hai ke FOMO ho raha hai menu dekh ke"
-• "Acha scene hai — budget friendly aur taste bhi solid"
-• "Full foodie mode activated, let's go"
-• "No cap, ye jagah underrated hai"
-
-=== FINAL RULE ===
-If the user sounds serious, stressed, or upset → DROP HUMOR COMPLETELY.
-You are a sharp foodie friend, NOT a troll.
-
-=== CORE INSTRUCTIONS ===
-• Use the provided context to answer questions
-• If context matches the query, recommend those restaurants
-• If context is empty or irrelevant, admit you don't know and ask for more details
-• Always mention price/budget if available
-• Be concise but helpful
-• Never insult a restaurant directly
-• Never mock culture, accents, or people
-
-=== FORMATTING ===
-• Use '•' (unicode bullet) for all list items. Do NOT use '*'.
-• Use plain text, avoid markdown formatting like **bold** or *italics*.
-• Capitalize restaurant names for emphasis instead of bolding.
-"""
+def _order_models(names: List[str]) -> List[str]:
+    # Prefer flash models, otherwise keep the order the API returned.
+    return [n for n in names if 'flash' in n] + [n for n in names if 'flash' not in n]
+
+def _chat_models(ordered: List[str]) -> List[str]:
+    # The discovered list includes TTS, image, preview and Gemma models that
+    # may not return .text or accept system_instruction. The primary still
+    # comes from the full list; fallbacks (and persona models) are limited to
+    # the known text models that are actually available.
+    return ordered[:1] + [n for n in PREFERRED_MODELS if n in ordered and n != ordered[0]]
+
+def _read_models_cache() -> Optional[List[str]]:
+    try:
+        if time.time() - os.path.getmtime(MODELS_CACHE_PATH) > MODELS_CACHE_TTL_SECONDS:
+            return None
+        with open(MODELS_CACHE_PATH, 'rb') as f:
+            names = orjson.loads(f.read())
+        return names or None
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def _write_models_cache(names: List[str]):
+    try:
+        os.makedirs(os.path.dirname(MODELS_CACHE_PATH), exist_ok=True)
+        with open(MODELS_CACHE_PATH, 'wb') as f:
+            f.write(orjson.dumps(names))
+    except OSError as e:
+        logger.warning(f"Could not write model cache: {e}")
+
+def _list_generate_models() -> List[str]:
+    return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+async def _refresh_models():
+    global model, valid_models, AVAILABLE_MODELS, CHAT_MODELS
+    try:
+        names = await asyncio.to_thread(_list_generate_models)
+    except Exception as e:
+        logger.error(f"Error listing Gemini models: {e}")
+        return
+    logger.info(f"Available Gemini Models: {names}")
+    if not names:
+        logger.error("No suitable Gemini model found.")
+        return
+    valid_models = names
+    AVAILABLE_MODELS = _order_models(names)
+    CHAT_MODELS = _chat_models(AVAILABLE_MODELS)
+    build_model_pool(CHAT_MODELS)
+    model = get_model(CHAT_MODELS[0])
+    logger.info(f"Using Gemini Model: {CHAT_MODELS[0]}")
+    _write_models_cache(names)
+
+def _directory_text(manager: RestaurantManager) -> str:
+    return "Full restaurant directory:\n" + "\n".join(r._snippet_with_menu for r in manager.idx_to_restaurant)
+
+def _create_context_cache(model_name: str, directory: str):
+    content = genai.caching.CachedContent.create(
+        model=model_name,
+        system_instruction=SYSTEM_PROMPT,
+        contents=[directory],
+        ttl=CONTEXT_CACHE_TTL_SECONDS,
+    )
+    return content, genai.GenerativeModel.from_cached_content(content)
+
+def _delete_context_cache(content):
+    try:
+        content.delete()
+    except Exception as e:
+        logger.warning(f"Could not delete cached content: {e}")
+
+async def _refresh_context_cache():
+    # The system prompt and the whole directory are uploaded once as Gemini
+    # cached content, so persona requests only send the per-turn delta.
+    # Models that reject caching (too few tokens, unsupported) just keep
+    # getting the full prompt.
+    if not manager:
+        return
+    model_name = CHAT_MODELS[0]
+    old_content = _context_cache["content"]
+    try:
+        content, cached_model = await asyncio.to_thread(_create_context_cache, model_name, _directory_text(manager))
+    except Exception as e:
+        logger.warning(f"Context caching unavailable for {model_name}: {e}")
+        _context_cache.update(model_name=None, model=None, content=None)
+    else:
+        _context_cache.update(model_name=model_name, model=cached_model, content=content)
+        logger.info(f"Cached system prompt and directory for {model_name} as {content.name}")
+    if old_content is not None:
+        await asyncio.to_thread(_delete_context_cache, old_content)
+
+async def _warm_gemini(list_models: bool):
+    if list_models:
+        await _refresh_models()
+    while True:
+        await _refresh_context_cache()
+        await asyncio.sleep(CONTEXT_CACHE_REFRESH_SECONDS)
 
 @app.on_event("startup")
-def startup_event():
-    global manager, model, session_store, valid_models
+async def startup_event():
+    global manager, model, session_store, valid_models, AVAILABLE_MODELS, CHAT_MODELS, dataset_version
     
     try:
         data_path = os.path.join(os.path.dirname(__file__), "data", "restaurants_data.json")
+        index_cache_path = os.path.join(os.path.dirname(__file__), "data", "restaurants.idx.pkl")
         if os.path.exists(data_path):
             try:
-                restaurants = load_data(data_path)
-                manager = RestaurantManager(restaurants)
-                logger.info(f"Loaded {len(restaurants)} restaurants.")
+                manager = load_manager(data_path, index_cache_path)
+                dataset_version = str(os.path.getmtime(data_path))
+                _get_candidates_cached.cache_clear()
+                _format_context.cache_clear()
+                reply_cache.clear()
+                logger.info(f"Loaded {len(manager.restaurants)} restaurants.")
             except Exception as e:
                 logger.error(f"Error loading restaurant data: {e}")
         else:
             logger.error(f"Data file not found at {data_path}")
 
+        load_index_html()
+
         try:
             session_store = SessionStore(sessions_dir, session_expiry_hours=24)
             logger.info(f"SessionStore initialized with {len(session_store.sessions)} existing sessions.")
@@ -149,51 +296,72 @@ def startup_event():
 
         if GEMINI_API_KEY:
             genai.configure(api_key=GEMINI_API_KEY)
-            try:
-                # Populate valid models list
-                for m in genai.list_models():
-                    if 'generateContent' in m.supported_generation_methods:
-                        valid_models.append(m.name)
-                
-                logger.info(f"Available Gemini Models: {valid_models}")
-
-                # Select primary model (prefer flash)
-                found_model_name = None
-                for name in valid_models:
-                    if 'flash' in name:
-                        found_model_name = name
-                        break
-                
-                if not found_model_name and valid_models:
-                    found_model_name = valid_models[0]
-                
-                if found_model_name:
-                    logger.info(f"Using Gemini Model: {found_model_name}")
-                    model = genai.GenerativeModel(found_model_name)
-                else:
-                    logger.error("No suitable Gemini model found.")
-            except Exception as e:
-                logger.error(f"Error configuring Gemini: {e}")
-                model = genai.GenerativeModel('gemini-1.5-flash')
+            # Serve immediately with the cached or preferred model list; the
+            # list_models round-trip only happens in the background.
+            cached_models = _read_models_cache()
+            if cached_models:
+                valid_models = cached_models
+                AVAILABLE_MODELS = _order_models(cached_models)
+                CHAT_MODELS = _chat_models(AVAILABLE_MODELS)
+            logger.info(f"Using Gemini Model: {CHAT_MODELS[0]}")
+            build_model_pool(CHAT_MODELS)
+            model = get_model(CHAT_MODELS[0])
+            task = asyncio.create_task(_warm_gemini(list_models=cached_models is None))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
         else:
             logger.warning("GEMINI_API_KEY not found. Please set it in .env")
             
     except Exception as e:
         logger.critical(f"Critical error during startup: {e}")
 
-@app.get("/health")
-def health_check():
-    return {"status": "ok", "manager_loaded": manager is not None, "model_loaded": model is not None}
+@app.on_event("shutdown")
+def shutdown_event():
+    if session_store:
+        session_store.close()
+    if _context_cache["content"] is not None:
+        _delete_context_cache(_context_cache["content"])
+
+class HealthResponse(BaseModel):
+    status: str
+    manager_loaded: bool
+    model_loaded: bool
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check():
+    return HealthResponse(status="ok", manager_loaded=manager is not None, model_loaded=model is not None)
+
 
+SEARCH_CACHE_CONTROL = "private, max-age=60"
+
+def _search_etag(kind: str, q: str) -> str:
+    digest = hashlib.blake2b(f"{dataset_version}:{kind}:{q}".encode(), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
 
 @app.get("/search/name", response_model=List[Restaurant])
-def search_by_name(q: str):
+async def search_by_name(q: str, request: Request, response: Response):
     if not manager: raise HTTPException(503, "Service not ready")
+    etag = _search_etag("name", q)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": SEARCH_CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = SEARCH_CACHE_CONTROL
     return manager.search_by_name(q)
 
 @app.get("/search/menu", response_model=List[Restaurant])
-def search_by_menu(q: str):
+async def search_by_menu(q: str, request: Request, response: Response):
     if not manager: raise HTTPException(503, "Service not ready")
+    etag = _search_etag("menu", q)
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": SEARCH_CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = SEARCH_CACHE_CONTROL
     return manager.search_by_menu(q)
 
 class ChatRequest(BaseModel):
@@ -213,14 +381,14 @@ class HistoryResponse(BaseModel):
     history: List[Dict[str, str]]
 
 @app.post("/session/new", response_model=SessionResponse)
-def create_new_session():
+async def create_new_session():
     if not session_store:
         raise HTTPException(status_code=503, detail="Service not ready")
     new_id = session_store.create_session()
     return SessionResponse(session_id=new_id)
 
 @app.get("/session/{session_id}/history", response_model=HistoryResponse)
-def get_session_history(session_id: str):
+async def get_session_history(session_id: str):
     if not session_store:
         raise HTTPException(status_code=503, detail="Service not ready")
     if not session_store.session_exists(session_id):
@@ -228,32 +396,211 @@ def get_session_history(session_id: str):
     history = session_store.get_history(session_id)
     return HistoryResponse(session_id=session_id, history=history)
 
-def get_relevant_candidates(message: str, manager: RestaurantManager) -> List[Restaurant]:
-    msg_lower = message.lower()
-    candidates = {}
-
-    budget_match = re.search(r'(\d+)', msg_lower)
+def extract_budget(msg_lower: str) -> Optional[int]:
+    # Only read a number as a price cap when the message talks about money,
+    # so "phase 2" or a phone number doesn't trigger the item-by-budget scan.
+    # The amount next to the hint word wins ("top 10 burgers under 800" is
+    # 800); otherwise take the largest amount, since counts and phases are
+    # smaller than prices.
+    budget_match = _BUDGET_RE.search(msg_lower)
     if budget_match:
-        amount = int(budget_match.group(1))
-        items = manager.search_items_by_budget(amount)
-        for item_res in items[:10]:
-            r = item_res['restaurant']
-            candidates[r.id] = r
-            
-    loc_results = manager.search_by_location(message)
-    for r in loc_results:
-        candidates[r.id] = r
-
-    menu_results = manager.search_by_menu(message)
-    for r in menu_results:
-        candidates[r.id] = r
-        
-    if len(message.split()) < 5:
-        name_results = manager.search_by_name(message)
-        for r in name_results:
-            candidates[r.id] = r
-    
-    return list(candidates.values())
+        return int(budget_match.group(1) or budget_match.group(2))
+    if not _BUDGET_HINT_RE.search(msg_lower):
+        return None
+    amounts = [int(m) for m in _AMOUNT_RE.findall(msg_lower)]
+    return max(amounts) if amounts else None
+
+def _candidates_cache_key(manager: RestaurantManager, key: str) -> str:
+    # The cache is cleared whenever a new manager is loaded, so the query
+    # alone identifies an entry.
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+@smart_cache(ttl=300, maxsize=1024, key=_candidates_cache_key)
+def _get_candidates_cached(manager: RestaurantManager, key: str) -> Tuple[int, ...]:
+    max_price = extract_budget(key)
+    pool = manager.search_candidate_ids(key, max_price, limit=RERANK_POOL_SIZE)
+    return tuple(manager.rerank_candidate_ids(key, pool, MAX_SUGGESTIONS, max_price))
+
+def normalize_message(message: str) -> str:
+    # Case and spacing never change a search or a reply, so the chat path
+    # lowercases once here and every lookup and cache key reuses the result.
+    # Word order is kept because the name search treats it as a prefix.
+    return " ".join(message.lower().split())
+
+def get_relevant_candidates(msg_key: str, manager: RestaurantManager) -> List[Restaurant]:
+    return [manager.idx_to_restaurant[i] for i in _get_candidates_cached(manager, msg_key)]
+
+CONTEXT_HEADER = "Here is the list of available restaurants in our database matching the query:\n"
+NO_CONTEXT_TEXT = CONTEXT_HEADER + "No specific restaurants found directly matching keywords in the database. Rely on your internal knowledge or ask clarifying questions.\n"
+
+@functools.lru_cache(maxsize=256)
+def _format_context(manager: RestaurantManager, candidate_ids: Tuple[str, ...], show_menu: bool) -> str:
+    if not candidate_ids:
+        return NO_CONTEXT_TEXT
+    restaurants = manager.restaurants
+    if show_menu:
+        snippets = [restaurants[rid]._snippet_with_menu for rid in candidate_ids]
+    else:
+        snippets = [restaurants[rid]._snippet for rid in candidate_ids]
+    return CONTEXT_HEADER + "\n".join(snippets) + "\n"
+
+def build_context(msg_key: str, candidates: List[Restaurant]) -> str:
+    # Menu samples are the bulk of the prompt; only send them when the user
+    # is actually asking about dishes or prices.
+    show_menu = extract_budget(msg_key) is not None or manager.menu_index.search(msg_key) != 0
+    # The UI shows up to MAX_SUGGESTIONS cards; only the best
+    # MAX_CONTEXT_CANDIDATES go into the prompt.
+    return _format_context(manager, tuple(r.id for r in candidates[:MAX_CONTEXT_CANDIDATES]), show_menu)
+
+def build_history_text(session_id: str) -> str:
+    # The newest entry is the message being answered, which the prompt
+    # already carries as "User Message".
+    # Turns evicted from the window but not yet summarized are still sent,
+    # so nothing said earlier drops out while the summary is in flight.
+    summary = session_store.get_summary(session_id)
+    parts = [f"Earlier summary: {summary}\n"] if summary else []
+    parts.extend(f"{role}: {message}\n" for role, message in session_store.get_pending_tuples(session_id))
+    parts.extend(f"{role}: {message}\n" for role, message in session_store.get_history_tuples(session_id)[:-1])
+    return "".join(parts)
+
+_time_cache = {"minute": -1, "val": ""}
+
+def _now_str() -> str:
+    # The prompt only shows hours and minutes, so format once per clock
+    # minute; the bucket flips exactly when the displayed value would.
+    minute = int(time.time()) // 60
+    if minute != _time_cache["minute"]:
+        _time_cache.update(minute=minute, val=datetime.datetime.now().strftime("%I:%M %p"))
+    return _time_cache["val"]
+
+PROMPT_TIME_PREFIX = "Context Information:\nCurrent Time: "
+PROMPT_HISTORY_HEADER = "\nConversation History:\n"
+PROMPT_USER_HEADER = "\n\nUser Message: "
+PROMPT_RESPONSE_SUFFIX = "\n\nResponse:"
+
+def build_prompt(user_msg: str, msg_key: str, candidates: List[Restaurant], history_text: str = "") -> str:
+    # The per-turn part only; persona models get the system prompt from
+    # their system_instruction or from Gemini cached content.
+    parts = [PROMPT_TIME_PREFIX, _now_str(), "\n", build_context(msg_key, candidates)]
+    if history_text:
+        parts += (PROMPT_HISTORY_HEADER, history_text)
+    parts += (PROMPT_USER_HEADER, user_msg, PROMPT_RESPONSE_SUFFIX)
+    return "".join(parts)
+
+reply_cache = SmartRAGCache(maxsize=512, ttl=600)
+
+def _reply_cache_key(msg_key: str, history_text: str) -> bytes:
+    # The prompt's clock line is left out so a repeated question within the
+    # TTL hits; candidates follow from the message, so it and the history
+    # are enough to identify a reply.
+    key = f"{history_text}\x00{msg_key}"
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+_inflight_replies: Dict[bytes, asyncio.Task] = {}
+
+async def generate_reply_shared(cache_key: bytes, prompt: str) -> str:
+    # Identical questions arriving while the first is still with Gemini wait
+    # on that call instead of each sending their own. shield keeps one
+    # client disconnecting from cancelling the reply for the others.
+    task = _inflight_replies.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(generate_reply(prompt, persona=True))
+        _inflight_replies[cache_key] = task
+        task.add_done_callback(lambda _: _inflight_replies.pop(cache_key, None))
+    return await asyncio.shield(task)
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and Inzaghi, a Peshawar food guide, in one line. "
+    "Keep the user's budget, location and food preferences.\n"
+)
+
+async def summarize_session(session_id: str):
+    summary, pending = session_store.take_pending_summary(session_id)
+    if not pending:
+        return
+    earlier = f"Earlier summary: {summary}\n" if summary else ""
+    turns = "".join(f"{m.get('role', '')}: {m.get('message', '')}\n" for m in pending)
+    try:
+        new_summary = await generate_reply(SUMMARY_PROMPT + earlier + turns)
+    except Exception as e:
+        logger.warning(f"Could not summarize session {session_id}: {e}")
+        return
+    session_store.set_summary(session_id, new_summary.strip(), len(pending))
+
+_summaries_in_flight = set()
+
+def schedule_summary(session_id: str):
+    # Pending turns stay pending until summarized, so one summary per session
+    # at a time keeps later turns from re-sending the same batch.
+    if model and session_id not in _summaries_in_flight and session_store.has_pending_summary(session_id):
+        _summaries_in_flight.add(session_id)
+        task = asyncio.create_task(summarize_session(session_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        task.add_done_callback(lambda _: _summaries_in_flight.discard(session_id))
+
+def llm_error_message(e: Exception) -> str:
+    if isinstance(e, asyncio.TimeoutError):
+        logger.warning(f"Gemini call timed out after {GEMINI_TIMEOUT_SECONDS}s.")
+        return "Maaf ka! I'm taking too long to think. Please try again."
+    if "429" in str(e):
+        logger.warning("Quota exceeded for gemini-2.5-flash.")
+        return "Maaf ka! Too many requests. Please wait a minute and try again."
+    logger.error(f"LLM Error: {e}")
+    return f"Maaf ka! I'm having trouble thinking right now. (Error: {str(e)})"
+
+MISSING_KEY_MESSAGE = "Gemini API Key is missing! I need it to wake up."
+
+def _pick_model(model_name: str, persona: bool) -> genai.GenerativeModel:
+    # Persona models already hold the system prompt, so the request text is
+    # sent as-is and never re-copies SYSTEM_PROMPT.
+    if not persona:
+        return get_model(model_name)
+    if _context_cache["model_name"] == model_name:
+        return _context_cache["model"]
+    if model_name not in _model_pool:
+        build_model_pool([model_name])
+    return _model_pool[model_name]
+
+async def generate_reply(prompt: str, persona: bool = False) -> str:
+    model_name = model_breaker.pick(CHAT_MODELS)
+    llm = _pick_model(model_name, persona)
+    try:
+        async with gemini_semaphore:
+            llm_response = await asyncio.wait_for(
+                llm.generate_content_async(prompt), timeout=GEMINI_TIMEOUT_SECONDS
+            )
+        text = llm_response.text
+    except Exception:
+        model_breaker.record_failure(model_name)
+        raise
+    model_breaker.record_success(model_name)
+    return text
+
+async def stream_reply(prompt: str, persona: bool = False) -> AsyncIterator[str]:
+    model_name = model_breaker.pick(CHAT_MODELS)
+    llm = _pick_model(model_name, persona)
+    # The opening await only returns the first chunk, so one deadline covers
+    # it and every later chunk; a stalled stream can't keep its semaphore
+    # slot.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GEMINI_TIMEOUT_SECONDS
+    try:
+        async with gemini_semaphore:
+            llm_stream = await asyncio.wait_for(
+                llm.generate_content_async(prompt, stream=True), timeout=deadline - loop.time()
+            )
+            chunks = aiter(llm_stream)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), timeout=deadline - loop.time())
+                except StopAsyncIteration:
+                    break
+                yield chunk.text
+    except Exception:
+        model_breaker.record_failure(model_name)
+        raise
+    model_breaker.record_success(model_name)
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -264,37 +611,145 @@ async def chat(request: ChatRequest):
     user_msg = request.message
     session_store.add_message(session_id, "user", user_msg)
     
-    current_time = datetime.datetime.now().strftime("%I:%M %p")
-    candidates = get_relevant_candidates(user_msg, manager)
-    candidates = candidates[:15]
-    
-    context_text = "Here is the list of available restaurants in our database matching the query:\n"
-    if candidates:
-        for r in candidates:
-            menu_sample = ", ".join([f"{m.item} ({m.price})" for m in r.menu[:5]])
-            context_text += f"- Name: {r.name}\n  Location: {r.location}\n  Budget: {r.budget}\n  Cuisine: {', '.join(r.cuisine)}\n  Deals: {r.deals}\n  Menu Sample: {menu_sample}\n\n"
-    else:
-        context_text += "No specific restaurants found directly matching keywords in the database. Rely on your internal knowledge or ask clarifying questions.\n"
+    msg_key = normalize_message(user_msg)
+    candidates = get_relevant_candidates(msg_key, manager)
 
     response_text = ""
     
     if model:
-        try:
-            full_prompt = f"{INZAGHI_SYSTEM_PROMPT}\n\nContext Information:\nCurrent Time: {current_time}\n{context_text}\n\nUser Message: {user_msg}\n\nResponse:"
-            llm_response = await model.generate_content_async(full_prompt)
-            response_text = llm_response.text
-        except Exception as e:
-            if "429" in str(e):
-                logger.warning("Quota exceeded for gemini-2.5-flash.")
-                response_text = "Maaf ka! Too many requests. Please wait a minute and try again."
-            else:
-                logger.error(f"LLM Error: {e}")
-                response_text = f"Maaf ka! I'm having trouble thinking right now. (Error: {str(e)})"
+        history_text = build_history_text(session_id)
+        cache_key = _reply_cache_key(msg_key, history_text)
+        response_text = reply_cache.get(cache_key)
+        if response_text is None:
+            prompt = build_prompt(user_msg, msg_key, candidates, history_text)
+            try:
+                response_text = await generate_reply_shared(cache_key, prompt)
+                reply_cache.set(cache_key, response_text)
+            except Exception as e:
+                response_text = llm_error_message(e)
     else:
-        response_text = "Gemini API Key is missing! I need it to wake up."
+        response_text = MISSING_KEY_MESSAGE
 
     session_store.add_message(session_id, "bot", response_text)
+    schedule_summary(session_id)
     
     return ChatResponse(response=response_text, suggestions=candidates, session_id=session_id)
 
+class CacheClearResponse(BaseModel):
+    cleared: int
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+@app.post("/chat/cache/clear", response_model=CacheClearResponse)
+async def clear_reply_cache(x_admin_token: Optional[str] = Header(default=None)):
+    # Flushing forces fresh Gemini calls, so it needs the admin token and is
+    # disabled entirely when none is configured.
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    cleared = len(reply_cache)
+    reply_cache.clear()
+    return CacheClearResponse(cleared=cleared)
+
+def _sse_event(text: str) -> bytes:
+    # JSON-encoding the chunk escapes its newlines, so every token is one
+    # single-line data field.
+    return b"data: " + orjson.dumps({"text": text}) + b"\n\n"
+
+def _sse_error_event(text: str) -> bytes:
+    return b"event: error\ndata: " + orjson.dumps({"text": text}) + b"\n\n"
+
+def _sse_done_event(reply: ChatResponse) -> bytes:
+    return b"event: done\ndata: " + reply.model_dump_json().encode() + b"\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    if not manager or not session_store:
+        raise HTTPException(status_code=503, detail="Service not ready")
+
+    session_id = session_store.get_or_create_session(request.session_id)
+    user_msg = request.message
+    session_store.add_message(session_id, "user", user_msg)
+
+    msg_key = normalize_message(user_msg)
+    candidates = get_relevant_candidates(msg_key, manager)
+
+    async def event_stream():
+        chunks = []
+        if model:
+            history_text = build_history_text(session_id)
+            cache_key = _reply_cache_key(msg_key, history_text)
+            cached = reply_cache.get(cache_key)
+            if cached is not None:
+                chunks.append(cached)
+                yield _sse_event(cached)
+            else:
+                prompt = build_prompt(user_msg, msg_key, candidates, history_text)
+                try:
+                    async for text in stream_reply(prompt, persona=True):
+                        chunks.append(text)
+                        yield _sse_event(text)
+                    reply_cache.set(cache_key, "".join(chunks))
+                except Exception as e:
+                    # Keep whatever arrived as the reply; the apology goes
+                    # out as its own event and is only stored if nothing did.
+                    message = llm_error_message(e)
+                    if not chunks:
+                        chunks.append(message)
+                    yield _sse_error_event(message)
+        else:
+            chunks.append(MISSING_KEY_MESSAGE)
+            yield _sse_event(MISSING_KEY_MESSAGE)
+
+        response_text = "".join(chunks)
+        session_store.add_message(session_id, "bot", response_text)
+        schedule_summary(session_id)
+        yield _sse_done_event(ChatResponse(response=response_text, suggestions=candidates, session_id=session_id))
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"X-Session-Id": session_id})
+
+INDEX_CACHE_CONTROL = "no-cache"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_index_page = {"html": None, "etag": ""}
+
+def load_index_html():
+    # index.html is read once; browsers revalidate it on every visit and get
+    # a 304 until a new frontend build is deployed.
+    try:
+        with open(os.path.join(static_dir, "index.html"), 'rb') as f:
+            html = f.read()
+    except OSError as e:
+        logger.warning(f"index.html not available: {e}")
+        return
+    digest = hashlib.blake2b(html, digest_size=8).hexdigest()
+    _index_page.update(html=html, etag=f'"{digest}"')
+
+@app.get("/", include_in_schema=False)
+@app.get("/index.html", include_in_schema=False)
+async def serve_index(request: Request):
+    if _index_page["html"] is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    headers = {"ETag": _index_page["etag"], "Cache-Control": INDEX_CACHE_CONTROL}
+    if _etag_matches(request, _index_page["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=_index_page["html"], media_type="text/html", headers=headers)
+
+class ImmutableStaticFiles(StaticFiles):
+    # Vite fingerprints everything under assets/, so a file at a given URL
+    # never changes and can be cached for a year.
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+        return response
+
+app.mount("/assets", ImmutableStaticFiles(directory=assets_dir), name="assets")
 app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
+
+if __name__ == "__main__":
+    import sys
+    import uvicorn
+
+    # uvloop has no Windows build; there uvicorn keeps its default loop and
+    # HTTP parser. Sessions are held in process memory, so stay on a single
+    # worker.
+    fast_io = {} if sys.platform == "win32" else {"loop": "uvloop", "http": "httptools"}
+    uvicorn.run("main:app", host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")), **fast_io)
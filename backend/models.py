@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, PrivateAttr
+from typing import List, Optional, Tuple
 
 class MenuItem(BaseModel):
     item: str
@@ -15,4 +15,13 @@ class Restaurant(BaseModel):
     cuisine: List[str] = []
     rating: Optional[float] = None
     budget: Optional[str] = None
-    location: Optional[str] = None
\ No newline at end of file
+    location: Optional[str] = None
+
+    _name_lc: str = PrivateAttr(default="")
+    _budget_lc: str = PrivateAttr(default="")
+    _location_lc: str = PrivateAttr(default="")
+    _menu_items_lc: Tuple[str, ...] = PrivateAttr(default=())
+    _menu_sample: str = PrivateAttr(default="")
+    _cuisine_joined: str = PrivateAttr(default="")
+    _snippet: str = PrivateAttr(default="")
+    _snippet_with_menu: str = PrivateAttr(default="")
\ No newline at end of file